@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+'''
+Benchmarks the parsing and statistics gathering part of stats_okh1.py
+on synthetic OKH corpora.
+
+It generates corpora of a configurable number of files,
+nesting depth and key variety,
+runs the stats pipeline on them in each of the available modes,
+and measures the time spent per stage (clean, parse, aggregate, write),
+the files processed per second and the peak RSS.
+Each run is done in a fresh process, so peak RSS values do not leak
+from one run into the next.
+The results are appended to a JSON-lines file,
+so they can be compared across code changes over time.
+'''
+
+import sys
+import os
+import json
+import time
+import random
+import platform
+import resource
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import yaml
+import click
+import stats_okh1
+
+CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
+
+DEFAULT_SIZES = '100,1000,10000,100000'
+CORPUS_DIR = 'bench_corpus'
+RESULTS_FILE = 'bench_results.jsonl'
+
+# Keys found in real OKH v1 files; the synthetic ones are added to these
+OKH_KEYS = ['title', 'description', 'project-link', 'image', 'version',
+        'license', 'licensor', 'documentation-home', 'archive-download',
+        'design-files', 'manufacturing-instructions', 'bom', 'user-manual',
+        'keywords', 'contact', 'contributors', 'made', 'made-independently',
+        'health-safety-notice', 'standards-used', 'derivative-of',
+        'variant-of', 'outputs', 'software', 'date-created', 'date-updated']
+
+# Leading line that gather_stats skips; real OKH files have a comment there
+LEADING_LINE = '# Open Know-How Manifest 1.0\n'
+
+def yaml_loaders():
+    '''
+    Returns the YAML loaders available in this environment, by mode name.
+    '''
+    loaders = {'current': yaml.SafeLoader}
+    if getattr(yaml, '__with_libyaml__', False):
+        loaders['csafe'] = yaml.CSafeLoader
+    return loaders
+
+def gen_value(rnd, keys, depth):
+    '''
+    Generates a random YAML value,
+    nesting dicts and lists up to the given depth.
+    '''
+    kind = rnd.random()
+    if depth <= 0 or kind < 0.5:
+        return 'value %d' % rnd.randrange(1000000)
+    if kind < 0.7:
+        return ['entry %d' % rnd.randrange(1000) for _ in range(rnd.randint(1, 4))]
+    if kind < 0.85:
+        return [gen_dict(rnd, keys, depth - 1, 3) for _ in range(rnd.randint(1, 3))]
+    return gen_dict(rnd, keys, depth - 1, 4)
+
+def gen_dict(rnd, keys, depth, max_keys):
+    return {key: gen_value(rnd, keys, depth)
+            for key in rnd.sample(keys, min(len(keys), rnd.randint(1, max_keys)))}
+
+def gen_corpus(corpus_dir, num_files, depth, num_keys, seed):
+    '''
+    Generates a corpus of synthetic OKH YAML files,
+    unless it already exists.
+    '''
+    done_marker = os.path.join(corpus_dir, '.complete')
+    if os.path.exists(done_marker):
+        return
+    os.makedirs(corpus_dir, exist_ok=True)
+    dumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+    rnd = random.Random(seed)
+    keys = OKH_KEYS + ['prop-%d' % i for i in range(max(0, num_keys - len(OKH_KEYS)))]
+    keys = keys[:num_keys]
+    print('Generating %d files in "%s" ...' % (num_files, corpus_dir))
+    for file_i in range(num_files):
+        cont = gen_dict(rnd, keys, depth, 12)
+        path = os.path.join(corpus_dir, '%06d-okh.yml' % file_i)
+        with open(path, 'w') as out_h:
+            out_h.write(LEADING_LINE)
+            yaml.dump(cont, out_h, Dumper=dumper, default_flow_style=False)
+    with open(done_marker, 'w'):
+        pass
+
+def run_pipeline(corpus_dir, mode):
+    '''
+    Runs the stats pipeline over a corpus,
+    and returns the measurements.
+    Meant to be run in a fresh process.
+    '''
+    loader = yaml_loaders()[mode]
+    times = {'clean': 0.0, 'parse': 0.0, 'aggregate': 0.0, 'write': 0.0}
+    stats = {}
+    num_files = 0
+    start = time.perf_counter()
+    for yaml_file in stats_okh1.list_yaml_files(corpus_dir):
+        t_0 = time.perf_counter()
+        stats_okh1.clean_yaml_file(yaml_file)
+        t_1 = time.perf_counter()
+        yaml_cont = stats_okh1.parse_yaml_file(yaml_file, loader=loader)
+        t_2 = time.perf_counter()
+        stats_okh1.append_stats(stats, yaml_cont)
+        t_3 = time.perf_counter()
+        times['clean'] += t_1 - t_0
+        times['parse'] += t_2 - t_1
+        times['aggregate'] += t_3 - t_2
+        num_files = num_files + 1
+    t_0 = time.perf_counter()
+    stats_okh1.write_stats(os.path.join(corpus_dir, 'stats-%s.txt' % mode),
+            stats, num_files)
+    times['write'] = time.perf_counter() - t_0
+    total = time.perf_counter() - start
+    return {
+            'num_files': num_files,
+            'num_keys_seen': len(stats),
+            'total_s': total,
+            'stage_s': times,
+            'files_per_s': num_files / total if total > 0 else None,
+            # kilobytes on Linux, bytes on macOS
+            'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            }
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                stderr=subprocess.DEVNULL,
+                cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def parse_list(value, conv=str):
+    return [conv(part.strip()) for part in value.split(',') if part.strip()]
+
+@click.command(context_settings=CONTEXT_SETTINGS)
+@click.option('--sizes', default=DEFAULT_SIZES, show_default=True,
+        help='Comma separated list of corpus sizes (number of files)')
+@click.option('--depth', type=int, default=3, show_default=True,
+        help='Maximum nesting depth of the generated YAML')
+@click.option('--keys', 'num_keys', type=int, default=40, show_default=True,
+        help='Number of distinct keys to choose from')
+@click.option('--seed', type=int, default=42, show_default=True)
+@click.option('--modes', default=None,
+        help='Comma separated list of modes to run (default: all available: %s)'
+        % ','.join(yaml_loaders()))
+@click.option('--repeat', type=int, default=1, show_default=True,
+        help='How often to run each size/mode combination')
+@click.option('--corpus-dir', type=click.Path(), default=CORPUS_DIR, show_default=True)
+@click.option('--results', 'results_file', type=click.Path(), default=RESULTS_FILE,
+        show_default=True, help='JSON-lines file to append the results to')
+@click.version_option("1.0")
+def bench(sizes=DEFAULT_SIZES, depth=3, num_keys=40, seed=42, modes=None,
+        repeat=1, corpus_dir=CORPUS_DIR, results_file=RESULTS_FILE):
+    '''
+    Benchmarks stats_okh1 on synthetic OKH corpora.
+    '''
+    available = yaml_loaders()
+    modes = parse_list(modes) if modes else list(available)
+    for mode in modes:
+        if mode not in available:
+            raise click.BadParameter('Mode "%s" is not available here; choose from: %s'
+                    % (mode, ', '.join(available)), param_hint='--modes')
+
+    revision = git_revision()
+    mp_ctx = multiprocessing.get_context('spawn')
+    with open(results_file, 'a') as results_h:
+        for size in parse_list(sizes, int):
+            size_dir = os.path.join(corpus_dir,
+                    'n%d-d%d-k%d-s%d' % (size, depth, num_keys, seed))
+            gen_corpus(size_dir, size, depth, num_keys, seed)
+            for mode in modes:
+                for _ in range(repeat):
+                    with ProcessPoolExecutor(max_workers=1, mp_context=mp_ctx) as executor:
+                        res = executor.submit(run_pipeline, size_dir, mode).result()
+                    res.update({
+                            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                            'revision': revision,
+                            'python': platform.python_version(),
+                            'platform': sys.platform,
+                            'mode': mode,
+                            'size': size,
+                            'depth': depth,
+                            'keys': num_keys,
+                            'seed': seed,
+                            })
+                    results_h.write(json.dumps(res, sort_keys=True) + '\n')
+                    results_h.flush()
+                    print('{:>7} files {:8} {:10.1f} files/s  peak RSS {:>8}  {}'.format(
+                            size, mode, res['files_per_s'], res['peak_rss'],
+                            '  '.join('%s %.3fs' % (k, v) for k, v in res['stage_s'].items())))
+
+if __name__ == '__main__':
+    bench()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+'''
+Checks that `losh --help` stays fast,
+and that it does not import any of the heavy libraries
+the sub-commands depend on.
+
+The time is measured as the median over a few runs,
+minus the median start-up time of a bare Python interpreter,
+which is out of our hands.
+Exits with a non-zero status if the check fails.
+'''
+
+import sys
+import os
+import json
+import time
+import statistics
+import subprocess
+import click
+
+CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
+
+HEAVY_MODULES = ['rdflib', 'requests', 'yaml', 'wikibase', 'profiling',
+        'rdfont2wb', 'wb2rdf', 'wdindex', 'stats_okh1', 'bench_stats_okh1']
+
+LOSH_HELP_CODE = '''
+import sys, json
+sys.argv = ['losh', '--help']
+import losh
+try:
+    losh.cli()
+except SystemExit:
+    pass
+sys.stderr.write(json.dumps([m for m in %r if m in sys.modules]))
+''' % (HEAVY_MODULES,)
+
+def time_run(code, runs):
+    here = os.path.dirname(os.path.abspath(__file__))
+    durations = []
+    last = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        last = subprocess.run([sys.executable, '-c', code], cwd=here,
+                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+        durations.append(time.perf_counter() - start)
+    return (statistics.median(durations), last.stderr.decode())
+
+@click.command(context_settings=CONTEXT_SETTINGS)
+@click.option('--budget-ms', type=float, default=100.0, show_default=True,
+        help='Maximum time `losh --help` may add on top of interpreter start-up')
+@click.option('--runs', type=int, default=7, show_default=True)
+def check(budget_ms=100.0, runs=7):
+    '''
+    Checks that `losh --help` is fast and imports no heavy libraries.
+    '''
+    (base_s, _) = time_run('pass', runs)
+    (help_s, loaded) = time_run(LOSH_HELP_CODE, runs)
+    loaded = json.loads(loaded)
+    overhead_ms = (help_s - base_s) * 1000
+    print('interpreter start-up: %6.1f ms' % (base_s * 1000))
+    print('losh --help:          %6.1f ms (+%.1f ms, budget %.1f ms)'
+            % (help_s * 1000, overhead_ms, budget_ms))
+    failed = False
+    if loaded:
+        print('FAIL: `losh --help` imported: %s' % ', '.join(loaded))
+        failed = True
+    if overhead_ms > budget_ms:
+        print('FAIL: `losh --help` is over budget')
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    check()
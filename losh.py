@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+'''
+Single entry point for all the LOSH tools.
+
+Each tool is a sub-command,
+which is only imported when it is actually invoked,
+so `losh --help` and `losh --version` do not pay for loading
+rdflib, requests or yaml.
+'''
+
+import importlib
+import click
+
+CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
+
+# name -> (module, click command within that module, short help)
+# To add a tool, add an entry here; keep the short help in sync
+# with the first line of the commands doc-string.
+COMMANDS = {
+        'ont2wb': ('rdfont2wb', 'cli',
+            'Converts the OKH RDF ontology into a WikiBase ontology.'),
+        'wb2rdf': ('wb2rdf', 'cli',
+            'Exports all items and properties of a WikiBase instance to RDF.'),
+        'wd-index': ('wdindex', 'cli',
+            'Indexes the properties of a Wikidata JSON dump by equivalent URI.'),
+        'okh-stats': ('stats_okh1', 'gather_stats',
+            'Gathers statistics about the keys used in OKH YAML files.'),
+        'okh-bench': ('bench_stats_okh1', 'bench',
+            'Benchmarks stats_okh1 on synthetic OKH corpora.'),
+        }
+
+class LazyGroup(click.Group):
+    '''
+    A click group that imports its sub-commands only on first use.
+    '''
+    def __init__(self, *args, lazy_commands=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_commands = lazy_commands if lazy_commands is not None else {}
+
+    def list_commands(self, ctx):
+        return sorted(set(super().list_commands(ctx)) | set(self.lazy_commands))
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name not in self.lazy_commands:
+            return super().get_command(ctx, cmd_name)
+        module_name, cmd_attr, _ = self.lazy_commands[cmd_name]
+        cmd = getattr(importlib.import_module(module_name), cmd_attr)
+        self.add_command(cmd, cmd_name)
+        del self.lazy_commands[cmd_name]
+        return cmd
+
+    def format_commands(self, ctx, formatter):
+        '''
+        Lists the sub-commands with their short help,
+        without importing the lazy ones.
+        '''
+        rows = []
+        for cmd_name in self.list_commands(ctx):
+            if cmd_name in self.lazy_commands:
+                rows.append((cmd_name, self.lazy_commands[cmd_name][2]))
+            else:
+                cmd = self.commands[cmd_name]
+                if not cmd.hidden:
+                    rows.append((cmd_name, cmd.get_short_help_str()))
+        if rows:
+            with formatter.section('Commands'):
+                formatter.write_dl(rows)
+
+@click.group(cls=LazyGroup, lazy_commands=dict(COMMANDS),
+        context_settings=CONTEXT_SETTINGS)
+@click.version_option("0.1.0", prog_name='losh')
+def cli():
+    '''
+    Tools for the LOSH project.
+    '''
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+'''
+Light-weight, phase-level profiling for the LOSH tools.
+
+A tool wraps each of its named phases in `with profiler.phase('name'):`.
+For every phase, the wall and CPU time get recorded,
+optionally the peak of traced memory (through tracemalloc),
+and optionally a cProfile dump gets written.
+Memory tracing is off by default, because tracemalloc slows down
+allocation-heavy code (like YAML parsing) several times,
+which distorts the recorded times.
+A phase may be entered many times (eg. once per file);
+its times are summed up, and the memory peak is the maximum.
+Phases are not meant to be nested.
+
+When profiling is disabled, phase() costs next to nothing.
+'''
+
+import os
+import json
+import time
+import cProfile
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+
+class PhaseStats:
+
+    def __init__(self):
+        self.count = 0
+        self.wall_s = 0.0
+        self.cpu_s = 0.0
+        self.peak_mem = None
+
+    def to_dict(self):
+        return OrderedDict([
+                ('count', self.count),
+                ('wall_s', self.wall_s),
+                ('cpu_s', self.cpu_s),
+                ('peak_mem_bytes', self.peak_mem),
+                ])
+
+class Profiler:
+    '''
+    Records wall time, CPU time and (optionally) memory peaks per named phase.
+    '''
+    def __init__(self, enabled=True, cprofile_dir=None, trace_memory=False):
+        self.enabled = enabled
+        self.cprofile_dir = cprofile_dir
+        self.trace_memory = enabled and trace_memory
+        self.phases = OrderedDict()
+        self.cprofiles = {}
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        stats = self.phases.setdefault(name, PhaseStats())
+        cprof = None
+        if self.cprofile_dir is not None:
+            cprof = self.cprofiles.setdefault(name, cProfile.Profile())
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        if cprof is not None:
+            cprof.enable()
+        try:
+            yield
+        finally:
+            if cprof is not None:
+                cprof.disable()
+            stats.cpu_s += time.process_time() - cpu_start
+            stats.wall_s += time.perf_counter() - wall_start
+            if self.trace_memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                stats.peak_mem = max(stats.peak_mem or 0, peak)
+            stats.count = stats.count + 1
+
+    def report_text(self):
+        lines = ['{:30} {:>8} {:>12} {:>12} {:>14}'.format(
+                'Phase', 'Count', 'Wall [s]', 'CPU [s]', 'Peak mem [KiB]')]
+        for name, stats in self.phases.items():
+            peak_mem = '-' if stats.peak_mem is None \
+                    else '%.1f' % (stats.peak_mem / 1024.0)
+            lines.append('{:30} {:>8} {:>12.3f} {:>12.3f} {:>14}'.format(
+                    name, stats.count, stats.wall_s, stats.cpu_s, peak_mem))
+        return '\n'.join(lines) + '\n'
+
+    def write_report(self, report_file):
+        '''
+        Writes the per-phase report to a file,
+        as JSON if its name ends in ".json", as a text table otherwise,
+        and dumps the cProfile data of each phase, if enabled.
+        '''
+        if not self.enabled:
+            return
+        with open(report_file, 'w') as report_h:
+            if report_file.endswith('.json'):
+                json.dump(OrderedDict((name, stats.to_dict())
+                        for name, stats in self.phases.items()),
+                        report_h, indent=2)
+                report_h.write('\n')
+            else:
+                report_h.write(self.report_text())
+        if self.cprofile_dir is not None:
+            os.makedirs(self.cprofile_dir, exist_ok=True)
+            for name, cprof in self.cprofiles.items():
+                cprof.dump_stats(os.path.join(self.cprofile_dir,
+                        name.replace(' ', '_') + '.prof'))
+
+NO_PROFILER = Profiler(enabled=False)
@@ -7,14 +7,21 @@ through its API (api.php).
 '''
 
 import os
+import re
+import json
+import hashlib
+from collections import OrderedDict
 import rdflib
 from rdflib.namespace import DC, DCTERMS, DOAP, FOAF, SKOS, OWL, RDF, RDFS, VOID, XMLNS, XSD
 import click
-from wikibase import WBSession, API_URL_OHO, enable_debug
+from wikibase import WBSession, WBSessionPool, API_URL_OHO, enable_debug
+from profiling import Profiler, NO_PROFILER
+from wdindex import WikidataPropertyIndex
 
 OBO = rdflib.Namespace('http://purl.obolibrary.org/obo/')
 SCHEMA = rdflib.Namespace('http://schema.org/')
 SPDX = rdflib.Namespace('http://spdx.org/rdf/terms#')
+WD = rdflib.Namespace('http://www.wikidata.org/entity/')
 
 CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
 
@@ -28,11 +35,19 @@ def version_token():
 
 RDF_FILE_LOCAL = '../LOSH/osh-metadata.ttl'
 RDF_FILE_REMOTE = 'https://raw.githubusercontent.com/OPEN-NEXT/LOSH/master/osh-metadata.ttl'
-RDF_FILE = RDF_FILE_LOCAL if os.path.exists(RDF_FILE_LOCAL) else RDF_FILE_REMOTE
 BASE_URI = 'http://purl.org/oseg/ontologies/osh-metadata/0.1/base'
 RDF_TO_WB_LINK_FILE = 'ont2wb_links.ttl'
+# Content hashes of the subjects, as of the last successful conversion
+RDF_TO_WB_SNAPSHOT_FILE = 'ont2wb_snapshot.json'
 
 
+def default_rdf_file():
+    '''
+    Returns the local ontology file if it exists,
+    the one from the LOSH repo on GitHub otherwise.
+    '''
+    return RDF_FILE_LOCAL if os.path.exists(RDF_FILE_LOCAL) else RDF_FILE_REMOTE
+
 def get_label_preds():
     return [RDFS.label or SKOS.prefLabel or DCTERMS.title or DC.title]
 
@@ -49,9 +64,29 @@ WD_PRED_IDS = ['P279', 'P1647', 'P305', 'P348', 'P144', 'P3931', 'P2479', 'P548'
 
 class RdfOntology2WikiBaseConverter:
 
-    def __init__(self, ttl_source, wbs, link_graph_file):
+    def __init__(self, ttl_source, wbs, link_graph_file, profiler=NO_PROFILER,
+            snapshot_file=None, full=False, prune=False, wd_index=None,
+            verbose=True):
+        '''
+        @param snapshot_file if given, only the subjects that changed since
+            the snapshot stored in this file get synced
+        @param full sync all subjects, even if the snapshot says they are unchanged
+        @param prune clear the WikiBase entities of subjects that were removed
+            from the ontology since the snapshot
+        @param wd_index a wdindex.WikidataPropertyIndex, used to resolve
+            the Wikidata equivalents of the substituted properties by URI
+        @param verbose print a line per subject and claim,
+            not only the summaries and warnings
+        '''
+        self.profiler = profiler
+        self.verbose = verbose
+        self.wd_index = wd_index
+        self.snapshot_file = snapshot_file
+        self.full = full
+        self.prune = prune
         self.graph = rdflib.Graph()
-        self.graph.load(ttl_source, format='turtle')
+        with self.profiler.phase('ontology-load'):
+            self.graph.load(ttl_source, format='turtle')
         self.wbs = wbs
         self.link_graph_file = link_graph_file
         self.ont2wb = rdflib.Graph()
@@ -59,8 +94,17 @@ class RdfOntology2WikiBaseConverter:
         self.label_sep = '\n\n'
         self.description_sep = '\n\n'
 
-    def create_ont_wb_thing(self, subj) -> str:
+    def log(self, msg):
+        '''
+        Prints progress info about single subjects and claims, if verbose.
+        '''
+        if self.verbose:
+            print(msg)
+
+    def create_ont_wb_thing(self, subj, wb_id=None) -> str:
         '''
+        Creates the WikiBase entity of a subject,
+        or only sets its labels and descriptions, if it already has one.
         data = {
                 'aliases': {},
                 'datatype': 'string' # XXX unused later on!
@@ -93,7 +137,116 @@ class RdfOntology2WikiBaseConverter:
             exit(1)
 
         #return "XXX"
-        return self.wbs.create_wb_thing(item=item, labels=lbs, descriptions=dscs, claims={})
+        return self.wbs.create_wb_thing(item=item, labels=lbs, descriptions=dscs, claims={},
+                wb_id=wb_id)
+
+    def canonical_lines(self, node, visited):
+        '''
+        Returns the sorted "predicate object" lines of a node,
+        with blank-node objects replaced by their own (nested) content,
+        so the result does not depend on blank-node IDs.
+        '''
+        lines = []
+        for _, pred, obj in self.graph.triples((node, None, None)):
+            if isinstance(obj, rdflib.BNode):
+                if obj in visited:
+                    obj_repr = '[]'
+                else:
+                    obj_repr = '[ %s ]' % ' ; '.join(
+                            self.canonical_lines(obj, visited | {obj}))
+            else:
+                obj_repr = obj.n3()
+            lines.append('%s %s' % (pred.n3(), obj_repr))
+        return sorted(lines)
+
+    def subject_hashes(self) -> dict:
+        '''
+        Returns a content hash for each (non-blank) subject of the ontology,
+        calculated over its canonicalized triples.
+        '''
+        hashes = {}
+        for subj in set(self.graph.subjects()):
+            if isinstance(subj, rdflib.BNode) or self.skip_subj(subj):
+                continue
+            content = '\n'.join(self.canonical_lines(subj, {subj}))
+            hashes[str(subj)] = hashlib.sha256(content.encode('utf-8')).hexdigest()
+        return hashes
+
+    def load_snapshot(self) -> dict:
+        if self.snapshot_file is None or not os.path.exists(self.snapshot_file):
+            return {}
+        with open(self.snapshot_file, 'r') as snap_h:
+            return json.load(snap_h)['subjects']
+
+    def write_snapshot(self, hashes):
+        if self.snapshot_file is None:
+            return
+        tmp_file = self.snapshot_file + '.tmp'
+        with open(tmp_file, 'w') as snap_h:
+            json.dump({'version': 1, 'subjects': hashes}, snap_h,
+                    indent=0, sort_keys=True)
+        os.replace(tmp_file, self.snapshot_file)
+
+    def plan_sync(self, had_links):
+        '''
+        Compares the current ontology to the last snapshot,
+        and returns the current subject hashes,
+        the set of subjects (as strings) that need to be synced,
+        and the removed subjects (as strings) with their last hashes.
+        '''
+        hashes = self.subject_hashes()
+        # Without the old links, the snapshot is worthless
+        snapshot = self.load_snapshot() if had_links else {}
+        added = [subj for subj in hashes if subj not in snapshot]
+        changed = [subj for subj in hashes
+                if subj in snapshot and snapshot[subj] != hashes[subj]]
+        removed = OrderedDict((subj, snap_hash) for subj, snap_hash in snapshot.items()
+                if subj not in hashes)
+        to_sync = set(added) | set(changed)
+        if self.full:
+            print('- Syncing all subjects (--full) ...')
+            to_sync.update(hashes)
+        # Also (re)sync subjects that lack a WikiBase ID for whatever reason
+        missing = [subj for subj in hashes if subj not in to_sync
+                and self.rdf2wb_id(rdflib.URIRef(subj), fail_if_missing=False) is None]
+        to_sync.update(missing)
+        skipped = [subj for subj in hashes if subj not in to_sync]
+        print('- Sync plan: %d added, %d changed, %d removed, %d without WikiBase ID, %d unchanged (skipped)'
+                % (len(added), len(changed), len(removed), len(missing),
+                    len(skipped)))
+        for title, subjs in (('added', added), ('changed', changed),
+                ('removed', removed), ('without WikiBase ID', missing),
+                ('unchanged (skipped)', skipped)):
+            for subj in sorted(subjs):
+                self.log('  - %s: %s' % (title, subj))
+        return (hashes, to_sync, removed)
+
+    def prune_removed(self, removed):
+        '''
+        Clears the WikiBase entities of the given, removed subjects,
+        and forgets about their links.
+        '''
+        for subj in removed:
+            subj_ref = rdflib.URIRef(subj)
+            wb_id = self.rdf2wb_id(subj_ref, fail_if_missing=False)
+            if wb_id is None:
+                continue
+            print('- Clearing "%s", which represented removed subject "%s" ...'
+                    % (wb_id, subj))
+            self.wbs.clear_thing(wb_id)
+            self.ont2wb.remove((subj_ref, SCHEMA.identifier, None))
+
+    def subject_groups(self):
+        '''
+        Groups the triples of the ontology by subject and predicate,
+        in a single pass over the graph.
+        Returns an OrderedDict: subject -> OrderedDict: predicate -> [objects]
+        '''
+        groups = OrderedDict()
+        for subj, pred, obj in self.graph:
+            preds = groups.setdefault(subj, OrderedDict())
+            preds.setdefault(pred, []).append(obj)
+        return groups
 
     def skip_subj(self, subj):
         return str(subj) == BASE_URI # It is the owl:Ontology instance
@@ -110,14 +263,18 @@ class RdfOntology2WikiBaseConverter:
                     % rdf_ref)
         return None
 
-    def create_claim(self, wb_id, subj, pred, obj):
+    def create_claim(self, wb_id, subj, pred, obj) -> bool:
+        '''
+        Adds the triple as a claim to the WikiBase entity of its subject,
+        and returns whether it was sent.
+        '''
         if pred in get_non_claim_preds():
-            return
+            return False
         claims = {}
         pred_wb_id = self.rdf2wb_id(pred)
         if pred_wb_id == 'P1647':
             print("WARNING: Not mapping wikidata.org property %s" % pred_wb_id)
-            return
+            return False
         value_type = None
         if isinstance(obj, rdflib.Literal):
             value_type = 'string'
@@ -181,26 +338,66 @@ url
             'type': 'statement',
             'rank': 'normal',
             }]
-        print('- Adding on %s claim %s (%s) ...'
+        self.log('- Adding on %s claim %s (%s) ...'
                 % (wb_id, str(claims), str(pred)))
         self.wbs.add_wb_thing_claims(wb_id, claims)
+        return True
 
-    def create_subst_property(self, rdf_pred_node, original_wd_id, label, obj_type):
-        if self.rdf2wb_id(rdf_pred_node, fail_if_missing=False) is not None:
+    def resolve_wd_property(self, rdf_pred_node, original_wd_id, property_type):
+        '''
+        Looks up the Wikidata property equivalent to an RDF property
+        in the Wikidata index, warns if it disagrees with our hand-made mapping,
+        and returns its ID, or original_wd_id if it is not indexed.
+        '''
+        if self.wd_index is None:
+            return original_wd_id
+        resolved = self.wd_index.resolve(rdf_pred_node)
+        if resolved is None:
+            self.log('- No Wikidata equivalent indexed for %s' % rdf_pred_node)
+            return original_wd_id
+        (wd_id, wd_label, wd_datatype) = resolved
+        if not re.fullmatch(r'P[0-9]+', original_wd_id):
+            self.log('- Resolved the Wikidata equivalent of %s to %s (%s)'
+                    % (rdf_pred_node, wd_id, wd_label))
+        elif wd_id != original_wd_id:
+            print('WARNING: Wikidata says %s is equivalent to %s (%s), not %s'
+                    % (rdf_pred_node, wd_id, wd_label, original_wd_id))
+        if wd_datatype != property_type:
+            print('WARNING: %s has datatype "%s" on Wikidata, but "%s" here'
+                    % (rdf_pred_node, wd_datatype, property_type))
+        return wd_id
+
+    def link_wd_property(self, rdf_pred_node, original_wd_id, property_type):
+        '''
+        Records the Wikidata equivalent of a substituted property
+        in the links, unless it is a placeholder (eg. "PXXXXXX").
+        One resolved through the Wikidata index replaces
+        the one already recorded; a hand-made one only fills in a missing one.
+        '''
+        wd_id = self.resolve_wd_property(rdf_pred_node, original_wd_id, property_type)
+        if not re.fullmatch(r'P[0-9]+', wd_id):
             return
+        linked = list(self.ont2wb.objects(rdf_pred_node, OWL.equivalentProperty))
+        if WD[wd_id] in linked or (len(linked) > 0 and wd_id == original_wd_id):
+            return
+        self.ont2wb.set((rdf_pred_node, OWL.equivalentProperty, WD[wd_id]))
 
-        lbs = {}
-        lbs[self.default_language] = label
+    def create_subst_property(self, rdf_pred_node, original_wd_id, label, obj_type):
+        property_type = 'string' if obj_type is None else 'wikibase-' + obj_type
 
-        dscs = {}
+        if self.rdf2wb_id(rdf_pred_node, fail_if_missing=False) is None:
+            lbs = {}
+            lbs[self.default_language] = label
 
-        item = False
+            dscs = {}
 
-        property_type = 'string' if obj_type is None else 'wikibase-' + obj_type
+            item = False
+
+            local_wb_id = self.wbs.create_wb_thing(item=item, labels=lbs, descriptions=dscs, claims={}, property_type=property_type)
 
-        local_wb_id = self.wbs.create_wb_thing(item=item, labels=lbs, descriptions=dscs, claims={}, property_type=property_type)
+            self.ont2wb.add((rdf_pred_node, SCHEMA.identifier, rdflib.Literal(local_wb_id)))
 
-        self.ont2wb.add((rdf_pred_node, SCHEMA.identifier, rdflib.Literal(local_wb_id)))
+        self.link_wd_property(rdf_pred_node, original_wd_id, property_type)
 
     def create_subst_item(self, rdf_indiv_node, original_wd_id, label, obj_type):
         if self.rdf2wb_id(rdf_indiv_node, fail_if_missing=False) is not None:
@@ -215,95 +412,205 @@ url
 
         self.ont2wb.add((rdf_indiv_node, SCHEMA.identifier, rdflib.Literal(local_wb_id)))
 
-    def convert(self):
+    def bootstrap_links(self):
+        '''
+        Loads the RDF-to-WikiBase links from the link file, if it exists,
+        creates the WikiBase properties and items that substitute
+        the ones we use from other ontologies, if they are not linked yet,
+        and (re-)resolves the Wikidata equivalents of the properties.
+        '''
         self.ont2wb = rdflib.Graph()
+        self.ont2wb.bind('owl', OWL)
+        self.ont2wb.bind('schema', SCHEMA)
+        self.ont2wb.bind('wd', WD)
         if os.path.exists(self.link_graph_file):
             self.ont2wb.load(self.link_graph_file, format='turtle')
+        self.create_subst_property(RDFS.subClassOf, 'P279', 'subClassOf', 'item') # https://www.wikidata.org/wiki/Property:P279
+        self.create_subst_property(RDFS.subPropertyOf, 'P1647', 'subPropertyOf', 'property') # https://www.wikidata.org/wiki/Property:P1647
+        #self.create_subst_property(SCHEMA.domain, SCHEMA.identifier, '')) #
+        #self.create_subst_property(SCHEMA.range, SCHEMA.identifier, '')) # -> datatype
+        self.create_subst_property(SCHEMA.inLanguage, 'P305', 'inLanguage',
+                None) # https://www.wikidata.org/wiki/Property:P305
+        self.create_subst_property(SCHEMA.version, 'P348', 'version',
+                None) # https://www.wikidata.org/wiki/Property:P348
+        self.create_subst_property(SCHEMA.isBasedOn, 'P144', 'isBasedOn',
+                'property') # https://www.wikidata.org/wiki/Property:P144
+        self.create_subst_property(SCHEMA.copyrightHolder,
+                'P3931', 'copyrightHolder', 'item') # https://www.wikidata.org/wiki/Property:P3931
+        self.create_subst_property(SCHEMA.licenseDeclared,
+                'P2479', 'licenseDeclared', 'item') # https://www.wikidata.org/wiki/Property:P2479
+        self.create_subst_property(SCHEMA.creativeWorkStatus,
+                'P548', 'creativeWorkStatus', None) # https://www.wikidata.org/wiki/Property:P548 - aka version type
+        self.create_subst_property(SCHEMA.image, 'P4765', 'image',
+                None) # https://www.wikidata.org/wiki/Property:P4765 - aka Commons compatible image available at URL
+        self.create_subst_property(SCHEMA.hasPart, 'P527', 'hasPart',
+                'item') # https://www.wikidata.org/wiki/Property:P527 - has part
+        #self.create_subst_property(SCHEMA.hasPart, 'P2670', '', True) # https://www.wikidata.org/wiki/Property:P2670 - has parts of the class
+        self.create_subst_property(SCHEMA.codeRepository,
+                'P1324', 'sourceCodeRepository', None) # https://www.wikidata.org/wiki/Property:P1324 - source code repository
+        self.create_subst_property(SCHEMA.value, 'P8203',
+                'supportedMetaData',
+                None) # https://www.wikidata.org/wiki/Property:P8203 -  aka supported Metadata
+        self.create_subst_property(OBO.BFO_0000016, 'P7535',
+                'scopeAndContent',
+                None) # function -> https://www.wikidata.org/wiki/Property:P7535 - aka scope and content
+        self.create_subst_property(SCHEMA.amount, 'P1114',
+                'quantity',
+                None) # https://www.wikidata.org/wiki/Property:P1114 -  aka quantity
+        self.create_subst_item(SCHEMA.URL, 'QXXXXXXX', 'URL',
+                None) # https://www.wikidata.org/wiki/Property:P2699 -  aka URL
+        self.create_subst_property(SPDX.licenseDeclared, 'PXXXXXXXX',
+                'licenseDeclared', None)
+        self.create_subst_property(SCHEMA.fileFormat, 'PXXXXXX', 'fileFormat',
+                None)
+
+    def convert(self):
+        had_links = os.path.exists(self.link_graph_file)
+        with self.profiler.phase('subst-bootstrap'):
+            self.bootstrap_links()
+
+        (hashes, to_sync, removed) = self.plan_sync(had_links)
+        if self.prune:
+            self.prune_removed(removed)
         else:
-            self.create_subst_property(RDFS.subClassOf, 'P279', 'subClassOf', 'item') # https://www.wikidata.org/wiki/Property:P279
-            self.create_subst_property(RDFS.subPropertyOf, 'P1647', 'subPropertyOf', 'property') # https://www.wikidata.org/wiki/Property:P1647
-            #self.create_subst_property(SCHEMA.domain, SCHEMA.identifier, '')) #
-            #self.create_subst_property(SCHEMA.range, SCHEMA.identifier, '')) # -> datatype
-            self.create_subst_property(SCHEMA.inLanguage, 'P305', 'inLanguage',
-                    None) # https://www.wikidata.org/wiki/Property:P305
-            self.create_subst_property(SCHEMA.version, 'P348', 'version',
-                    None) # https://www.wikidata.org/wiki/Property:P348
-            self.create_subst_property(SCHEMA.isBasedOn, 'P144', 'isBasedOn',
-                    'property') # https://www.wikidata.org/wiki/Property:P144
-            self.create_subst_property(SCHEMA.copyrightHolder,
-                    'P3931', 'copyrightHolder', 'item') # https://www.wikidata.org/wiki/Property:P3931
-            self.create_subst_property(SCHEMA.licenseDeclared,
-                    'P2479', 'licenseDeclared', 'item') # https://www.wikidata.org/wiki/Property:P2479
-            self.create_subst_property(SCHEMA.creativeWorkStatus,
-                    'P548', 'creativeWorkStatus', None) # https://www.wikidata.org/wiki/Property:P548 - aka version type
-            self.create_subst_property(SCHEMA.image, 'P4765', 'image',
-                    None) # https://www.wikidata.org/wiki/Property:P4765 - aka Commons compatible image available at URL
-            self.create_subst_property(SCHEMA.hasPart, 'P527', 'hasPart',
-                    'item') # https://www.wikidata.org/wiki/Property:P527 - has part
-            #self.create_subst_property(SCHEMA.hasPart, 'P2670', '', True) # https://www.wikidata.org/wiki/Property:P2670 - has parts of the class
-            self.create_subst_property(SCHEMA.codeRepository,
-                    'P1324', 'sourceCodeRepository', None) # https://www.wikidata.org/wiki/Property:P1324 - source code repository
-            self.create_subst_property(SCHEMA.value, 'P8203',
-                    'supportedMetaData',
-                    None) # https://www.wikidata.org/wiki/Property:P8203 -  aka supported Metadata
-            self.create_subst_property(OBO.BFO_0000016, 'P7535',
-                    'scopeAndContent',
-                    None) # function -> https://www.wikidata.org/wiki/Property:P7535 - aka scope and content
-            self.create_subst_property(SCHEMA.amount, 'P1114',
-                    'quantity',
-                    None) # https://www.wikidata.org/wiki/Property:P1114 -  aka quantity
-            self.create_subst_item(SCHEMA.URL, 'QXXXXXXX', 'URL',
-                    None) # https://www.wikidata.org/wiki/Property:P2699 -  aka URL
-            self.create_subst_property(SPDX.licenseDeclared, 'PXXXXXXXX',
-                    'licenseDeclared', None)
-            self.create_subst_property(SCHEMA.fileFormat, 'PXXXXXX', 'fileFormat',
-                    None)
+            # Remember the removed subjects, so a later run can still prune them
+            hashes.update(removed)
 
+        # Visit each subject exactly once per phase;
+        # self.graph.subjects() would yield it once per triple
+        groups = self.subject_groups()
 
         # create the items and properties
-        for subj in self.graph.subjects():
-            if self.skip_subj(subj):
-                continue
-            wb_ids = list(self.ont2wb.objects(subj, SCHEMA.identifier))
-            wb_id = wb_ids[0] if len(wb_ids) > 0 else None
-            if wb_id is None:
-                print('- Creating WB part for subject "%s" ...' % subj)
-                wb_id = self.create_ont_wb_thing(subj)
-                self.ont2wb.add((subj, SCHEMA.identifier, rdflib.Literal(wb_id)))
-            #else: # XXX We might want to recreate it here, anyway!
-            print('- Subject "%s" is represented by "%s"' % (subj, wb_id))
+        with self.profiler.phase('entity-creation'):
+            for subj in groups:
+                if self.skip_subj(subj) or str(subj) not in to_sync:
+                    continue
+                wb_ids = list(self.ont2wb.objects(subj, SCHEMA.identifier))
+                wb_id = wb_ids[0] if len(wb_ids) > 0 else None
+                if wb_id is None:
+                    self.log('- Creating WB part for subject "%s" ...' % subj)
+                    wb_id = self.create_ont_wb_thing(subj)
+                    self.ont2wb.add((subj, SCHEMA.identifier, rdflib.Literal(wb_id)))
+                else:
+                    # Its claims get sent anew below, so drop the stale ones
+                    self.log('- Updating WB part "%s" for subject "%s" ...' % (wb_id, subj))
+                    self.wbs.clear_thing(str(wb_id))
+                    self.create_ont_wb_thing(subj, str(wb_id))
+                self.log('- Subject "%s" is represented by "%s"' % (subj, wb_id))
 
-        self.ont2wb.serialize(self.link_graph_file, format='turtle')
+        with self.profiler.phase('link-serialization'):
+            self.ont2wb.serialize(self.link_graph_file, format='turtle')
 
         # Create the connections/predicates/claims
-        for subj in self.graph.subjects():
-            if self.skip_subj(subj):
+        num_subjs = 0
+        num_triples = 0
+        num_claims = 0
+        with self.profiler.phase('claims'):
+            for subj, preds in groups.items():
+                if self.skip_subj(subj) or str(subj) not in to_sync:
+                    continue
+                wb_id = str(next(self.ont2wb.objects(subj, SCHEMA.identifier)))
+                subj_triples = 0
+                subj_claims = 0
+                for pred, objs in preds.items():
+                    for obj in objs:
+                        subj_triples = subj_triples + 1
+                        if pred == RDFS.range:
+                            self.log('XXX range')
+                        elif pred == RDFS.domain:
+                            self.log('XXX domain')
+                        elif self.create_claim(wb_id, subj, pred, obj):
+                            subj_claims = subj_claims + 1
+                self.log('- Subject "%s" (%s): %d triples, %d claims sent'
+                        % (subj, wb_id, subj_triples, subj_claims))
+                num_subjs = num_subjs + 1
+                num_triples = num_triples + subj_triples
+                num_claims = num_claims + subj_claims
+        print('- Sent %d claims for %d distinct triples of %d subjects'
+                % (num_claims, num_triples, num_subjs))
+
+        self.write_snapshot(hashes)
+
+def read_credentials(accounts_file):
+    '''
+    Reads bot account credentials from a file,
+    with one "user password" pair per line.
+    Empty lines and lines starting with '#' are ignored.
+    '''
+    credentials = []
+    with open(accounts_file, 'r') as acc_h:
+        for line in acc_h:
+            line = line.strip()
+            if line == '' or line.startswith('#'):
                 continue
-            wb_ids = list(self.ont2wb.objects(subj, SCHEMA.identifier))
-            wb_id = wb_ids[0]
-            if isinstance(wb_id, rdflib.Literal):
-                wb_id = str(wb_id)
-            for _, pred, obj in self.graph.triples((subj, None, None)):
-                if pred == RDFS.range:
-                    print('XXX range')
-                elif pred == RDFS.domain:
-                    print('XXX domain')
-                else:
-                    self.create_claim(wb_id, subj, pred, obj)
+            parts = line.split(None, 1)
+            if len(parts) != 2:
+                raise click.BadParameter('Expected "user password" per line in "%s"'
+                        % accounts_file, param_hint='--accounts')
+            credentials.append((parts[0], parts[1].strip()))
+    return credentials
 
 @click.command(context_settings=CONTEXT_SETTINGS)
-@click.argument('user', envvar='USER')
-@click.argument('passwd', envvar='PASSWD')
+@click.argument('user', envvar='USER', required=False)
+@click.argument('passwd', envvar='PASSWD', required=False)
+@click.option('--rdf-file', default=None,
+        help='Ontology to convert (default: %s if it exists, else %s)'
+        % (RDF_FILE_LOCAL, RDF_FILE_REMOTE))
+@click.option('--accounts', type=click.Path(exists=True, dir_okay=False), default=None,
+        help='File with one "user password" bot account per line; '
+        'writes are spread over all of them, and USER and PASSWD are ignored')
+@click.option('--edits-per-minute', type=float, default=None,
+        help='Rate budget of each account given with --accounts')
+@click.option('--profile', 'profile_file', type=click.Path(dir_okay=False), default=None,
+        help='Write a per-phase time report to this file (JSON if it ends in .json)')
+@click.option('--profile-memory', is_flag=True,
+        help='With --profile, also record the memory peak per phase (slows down the run)')
+@click.option('--cprofile-dir', type=click.Path(file_okay=False), default=None,
+        help='With --profile, also write a cProfile dump per phase into this directory')
+@click.option('--quiet', '-q', is_flag=True,
+        help='Only print summaries and warnings, not a line per subject, claim and API call')
+@click.option('--full', is_flag=True,
+        help='Sync all subjects, not only the ones changed since the last run')
+@click.option('--prune', is_flag=True,
+        help='Clear the WikiBase entities of subjects removed since the last run')
+@click.option('--wd-index', 'wd_index_file', type=click.Path(exists=True, dir_okay=False),
+        default=None,
+        help='Wikidata property index (see wdindex.py) to resolve Wikidata equivalents with')
 @click.version_option("0.1.0")
-def cli(user, passwd):
+def cli(user, passwd, rdf_file=None, accounts=None, edits_per_minute=None,
+        profile_file=None, profile_memory=False, cprofile_dir=None,
+        quiet=False, full=False, prune=False, wd_index_file=None):
+    '''
+    Converts the OKH RDF ontology into a WikiBase ontology.
+    '''
     # Run as a CLI script
     #enable_debug()
-    wbs = WBSession(API_URL_OHO)
-    #wbs.bot_login(bot_user, bot_passwd)
-    wbs.login(user, passwd)
-
-    converter = RdfOntology2WikiBaseConverter(RDF_FILE, wbs, RDF_TO_WB_LINK_FILE)
-    converter.convert()
+    if accounts is not None:
+        wbs = WBSessionPool(API_URL_OHO, read_credentials(accounts),
+                edits_per_minute=edits_per_minute, verbose=not quiet)
+        wbs.login()
+    else:
+        if user is None or passwd is None:
+            raise click.UsageError('Either USER and PASSWD, or --accounts are required')
+        wbs = WBSession(API_URL_OHO, verbose=not quiet)
+        #wbs.bot_login(bot_user, bot_passwd)
+        wbs.login(user, passwd)
+
+    if rdf_file is None:
+        rdf_file = default_rdf_file()
+    wd_index = None
+    if wd_index_file is not None:
+        wd_index = WikidataPropertyIndex(wd_index_file)
+    profiler = Profiler(cprofile_dir=cprofile_dir, trace_memory=profile_memory) \
+            if profile_file else NO_PROFILER
+    try:
+        converter = RdfOntology2WikiBaseConverter(rdf_file, wbs, RDF_TO_WB_LINK_FILE,
+                profiler, RDF_TO_WB_SNAPSHOT_FILE, full=full, prune=prune,
+                wd_index=wd_index, verbose=not quiet)
+        converter.convert()
+    finally:
+        if profile_file:
+            profiler.write_report(profile_file)
 
 if __name__ == "__main__":
     cli()
@@ -10,12 +10,18 @@ import sys
 import re
 import os
 import glob
+import math
 from collections import OrderedDict
 import csv
-import urllib
-import urllib.request
+import time
+import socket
+import threading
+import urllib.parse
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+import requests
 import yaml
 import click
+from profiling import Profiler, NO_PROFILER
 
 CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
 
@@ -29,21 +35,280 @@ def version_token():
 def eprint(*args, **kwargs):
     print(*args, file=sys.stderr, **kwargs)
 
-class AppURLopener(urllib.request.FancyURLopener):
-    version = "Mozilla/5.0 (Windows NT 6.3; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/47.0.2526.69 Safari/537.36"
+USER_AGENT = "Mozilla/5.0 (Windows NT 6.3; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/47.0.2526.69 Safari/537.36"
 
-urllib._urlopener = AppURLopener()
+# (connect, read) timeouts in seconds
+DEFAULT_TIMEOUTS = (10.0, 60.0)
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF = 1.0
+# How many downloads from a host we need to have seen,
+# before we trust its latency percentile enough to hedge against it
+HEDGE_MIN_SAMPLES = 5
 
+class DownloadError(RuntimeError):
+    '''
+    Raised when a download failed for good (after all retries).
+    Like urllib.error.HTTPError, it carries a code and a reason;
+    for non-HTTP failures, the code is a short failure class name,
+    like 'dns', 'connect-timeout' or 'read-timeout'.
+    '''
+    def __init__(self, url, code, reason):
+        super().__init__('%s: %s - %s' % (url, code, reason))
+        self.url = url
+        self.code = code
+        self.reason = reason
+
+def wrapped_errors(err):
+    '''
+    Yields the given error, and all the errors it wraps.
+    requests wraps the original socket or urllib3 error a few levels deep.
+    '''
+    seen = set()
+    while err is not None and id(err) not in seen:
+        seen.add(id(err))
+        yield err
+        wrapped = getattr(err, 'reason', None)
+        if not isinstance(wrapped, BaseException) and err.args \
+                and isinstance(err.args[0], BaseException):
+            wrapped = err.args[0]
+        if not isinstance(wrapped, BaseException):
+            wrapped = err.__cause__ or err.__context__
+        err = wrapped
+
+def is_dns_failure(err):
+    '''
+    Whether a connection error was caused by a failed host-name lookup.
+    '''
+    return any(isinstance(wrapped, socket.gaierror)
+            or type(wrapped).__name__ == 'NameResolutionError'
+            for wrapped in wrapped_errors(err))
+
+def is_read_timeout(err):
+    '''
+    Whether a connection error was caused by a read timeout;
+    requests reports those as ConnectionError
+    when they happen while streaming the body.
+    '''
+    return any(type(wrapped).__name__ == 'ReadTimeoutError'
+            for wrapped in wrapped_errors(err))
+
+def failure_class(err):
+    '''
+    Maps an exception raised while downloading
+    to a (code, reason) tuple.
+    '''
+    if isinstance(err, requests.HTTPError) and err.response is not None:
+        return (err.response.status_code, err.response.reason)
+    if isinstance(err, requests.ConnectTimeout):
+        return ('connect-timeout', str(err))
+    if isinstance(err, requests.ReadTimeout):
+        return ('read-timeout', str(err))
+    if isinstance(err, requests.ConnectionError):
+        if is_dns_failure(err):
+            return ('dns', str(err))
+        if is_read_timeout(err):
+            return ('read-timeout', str(err))
+        return ('connection', str(err))
+    if isinstance(err, requests.TooManyRedirects):
+        return ('redirects', str(err))
+    if isinstance(err, requests.RequestException):
+        return ('request', str(err))
+    if isinstance(err, OSError):
+        return ('io', str(err))
+    return (type(err).__name__, str(err))
+
+def is_retryable(code):
+    '''
+    Whether a failure with the given code (see failure_class())
+    might go away when simply trying again.
+    '''
+    if isinstance(code, int):
+        return code == 429 or code >= 500
+    return code in ('dns', 'connection', 'connect-timeout', 'read-timeout')
+
+def percentile(values, pct):
+    '''
+    Returns the nearest-rank percentile of a list of numbers.
+    '''
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
 
-def download(url, path):
+class Downloader:
+    '''
+    Downloads files over HTTP(S),
+    with per-host connect and read timeouts,
+    bounded retries with exponential backoff,
+    and optionally hedged requests:
+    If a download from a host takes longer than the given percentile
+    of the latencies seen so far for that host,
+    a second, identical request is sent,
+    and whichever of the two finishes first wins.
+    '''
+    def __init__(self, timeouts=DEFAULT_TIMEOUTS, host_timeouts=None,
+            retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF,
+            hedge_percentile=None, verbose=True):
+        self.http_sess = requests.Session()
+        self.http_sess.headers['User-Agent'] = USER_AGENT
+        self.timeouts = timeouts
+        self.host_timeouts = host_timeouts if host_timeouts is not None else {}
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge_percentile = hedge_percentile
+        self.verbose = verbose
+        self.latencies = {}
+        self.num_hedged = 0
+        # Threads of hedged requests, which may outlive their download
+        self.threads = []
+
+    def close(self):
+        '''
+        Closes the underlying HTTP session,
+        after waiting for still running (losing) hedged requests.
+        After calling this, further use of other methods will fail.
+        '''
+        for thread in self.threads:
+            thread.join()
+        self.http_sess.close()
+
+    def timeouts_for(self, host):
+        return self.host_timeouts.get(host, self.timeouts)
+
+    def hedge_delay(self, host):
+        '''
+        Returns after how many seconds a hedged request should be sent
+        to the given host, or None if we should not hedge (yet).
+        '''
+        if not self.hedge_percentile:
+            return None
+        host_lats = self.latencies.get(host, [])
+        if len(host_lats) < HEDGE_MIN_SAMPLES:
+            return None
+        return percentile(host_lats, self.hedge_percentile)
+
+    def fetch_to(self, url, tmp_path, timeouts):
+        '''
+        Does a single download attempt into tmp_path,
+        and returns the time it took in seconds.
+        On failure, tmp_path is removed again.
+        '''
+        start = time.monotonic()
+        try:
+            with self.http_sess.get(url, timeout=timeouts, stream=True) as res:
+                res.raise_for_status()
+                with open(tmp_path, 'wb') as out_h:
+                    for chunk in res.iter_content(chunk_size=64 * 1024):
+                        out_h.write(chunk)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return time.monotonic() - start
+
+    def fetch(self, url, path, timeouts):
+        '''
+        Does a single download attempt,
+        only replacing path once the whole file arrived,
+        and returns the time it took in seconds.
+        '''
+        tmp_path = path + '.part'
+        latency = self.fetch_to(url, tmp_path, timeouts)
+        os.replace(tmp_path, path)
+        return latency
+
+    def start_fetch(self, url, tmp_path, timeouts) -> Future:
+        '''
+        Runs fetch_to() in a thread of its own,
+        so a hedged request never has to wait for a losing one.
+        '''
+        fut = Future()
+        def run():
+            try:
+                fut.set_result(self.fetch_to(url, tmp_path, timeouts))
+            except BaseException as err:
+                fut.set_exception(err)
+        thread = threading.Thread(target=run, daemon=True)
+        self.threads = [thr for thr in self.threads if thr.is_alive()]
+        self.threads.append(thread)
+        thread.start()
+        return fut
+
+    def fetch_hedged(self, url, path, timeouts, delay):
+        '''
+        Like fetch(), but sends a second request
+        if the first one did not finish within delay seconds.
+        Returns the time since the first request was sent,
+        even if the second one won, so the host's slow tail
+        still shows up in its latencies.
+        '''
+        tmp_paths = [path + '.part0', path + '.part1']
+        start = time.monotonic()
+        pending = {self.start_fetch(url, tmp_paths[0], timeouts): tmp_paths[0]}
+        done, _ = wait(pending, timeout=delay)
+        if not done:
+            self.num_hedged = self.num_hedged + 1
+            pending[self.start_fetch(url, tmp_paths[1], timeouts)] = tmp_paths[1]
+        last_err = None
+        remaining = set(pending)
+        while remaining:
+            done, remaining = wait(remaining, return_when=FIRST_COMPLETED)
+            for fut in done:
+                if fut.exception() is None:
+                    os.replace(pending[fut], path)
+                    for loser in remaining:
+                        # fetch_to() cleans up after failures itself
+                        loser.add_done_callback(
+                                lambda f, p=pending[loser]: f.exception() is None
+                                and os.path.exists(p) and os.remove(p))
+                    return time.monotonic() - start
+                last_err = fut.exception()
+        raise last_err
+
+    def download(self, url, path):
+        '''
+        Downloads a URL pointing to a file into a local file,
+        pointed to by path.
+        Raises DownloadError if all attempts failed.
+        '''
+        host = urllib.parse.urlparse(url).netloc
+        timeouts = self.timeouts_for(host)
+        attempt = 0
+        while True:
+            try:
+                delay = self.hedge_delay(host)
+                if delay is None:
+                    latency = self.fetch(url, path, timeouts)
+                else:
+                    latency = self.fetch_hedged(url, path, timeouts, delay)
+                self.latencies.setdefault(host, []).append(latency)
+                return
+            except Exception as err:
+                (code, reason) = failure_class(err)
+                if attempt >= self.retries or not is_retryable(code):
+                    raise DownloadError(url, code, reason) from err
+                sleep_s = self.backoff * (2 ** attempt)
+                eprint('WARNING: Download of %s failed (%s), retrying in %.1fs ...'
+                        % (url, code, sleep_s))
+                time.sleep(sleep_s)
+                attempt = attempt + 1
+
+_default_downloader = None
+
+def download(url, path, downloader=None):
     '''
     Downloads a URL pointing to a file into a local file,
     pointed to by path.
     '''
-    print('downloading %s to %s ...' % (url, path))
+    global _default_downloader
+    if downloader is None:
+        if _default_downloader is None:
+            _default_downloader = Downloader()
+        downloader = _default_downloader
+    if downloader.verbose:
+        print('downloading %s to %s ...' % (url, path))
     if os.path.exists(path):
         os.remove(path)
-    urllib._urlopener.retrieve(url, path)
+    downloader.download(url, path)
 
 def urlify(s):
 
@@ -55,13 +320,13 @@ def urlify(s):
 
     return s
 
-def download_all_ymls(okh_dir):
+def download_all_ymls(okh_dir, downloader=None):
 
     if not os.path.exists(okh_dir):
         os.mkdir(okh_dir)
 
     csv_file = os.path.join(okh_dir, 'projects.csv')
-    download(OKH_LIST_URL, csv_file)
+    download(OKH_LIST_URL, csv_file, downloader)
 
     num_entries = -1
     num_success = 0
@@ -84,9 +349,9 @@ def download_all_ymls(okh_dir):
                 if not url_base in url_bases:
                     url_bases[url_base] = 0
                 url_bases[url_base] = url_bases[url_base] + 1
-                download(url, local_yml_file)
+                download(url, local_yml_file, downloader)
                 num_success = num_success + 1
-            except urllib.error.HTTPError as err:
+            except DownloadError as err:
                 eprint('WARNING: Failed to download %s to %s, because %s'
                         % (url, local_yml_file, err))
                 errors.append((url, err.code, err.reason))
@@ -107,6 +372,8 @@ def download_all_ymls(okh_dir):
             'error_url_codes': error_url_codes,
             'error_code_reason': error_code_reason
             }
+    if downloader is not None:
+        dl_stats['num_hedged'] = downloader.num_hedged
 
     return (csv_file, dl_stats)
 
@@ -130,6 +397,57 @@ def append_stats(stats, yaml_cont, prefix=''):
         else:
             increase_key(stats, key_full)
 
+def parse_host_timeouts(host_timeout_specs):
+    '''
+    Parses a list of "HOST=CONNECT,READ" strings
+    into a dict: host -> (connect, read).
+    '''
+    host_timeouts = {}
+    for spec in host_timeout_specs:
+        try:
+            host, timeouts = spec.split('=', 1)
+            connect, read = timeouts.split(',', 1)
+            host_timeouts[host.strip()] = (float(connect), float(read))
+        except ValueError:
+            raise click.BadParameter(
+                    'Expected HOST=CONNECT,READ, got "%s"' % spec,
+                    param_hint='--host-timeout')
+    return host_timeouts
+
+def list_yaml_files(okh_dir):
+    return glob.glob(os.path.join(okh_dir, '*-okh.yml'))
+
+def clean_yaml_file(yaml_file):
+    '''
+    Writes a copy of the given YAML file with a ".clean" suffix,
+    with the '@' removed from the start of values.
+    '''
+    yaml_file_clean = yaml_file + ".clean"
+    with open(yaml_file, 'rt') as fin:
+        with open(yaml_file_clean, 'wt') as fout:
+            for line in fin:
+                fout.write(line.replace(': @', ': '))
+    #os.rename(yaml_file_clean, yaml_file)
+    return yaml_file_clean
+
+def parse_yaml_file(yaml_file, loader=yaml.SafeLoader):
+    '''
+    Parses an OKH YAML file, skipping its first line.
+    '''
+    with open(yaml_file, 'r') as yaml_h:
+        # skip first line
+        next(yaml_h)
+        return yaml.load(yaml_h, Loader=loader)
+
+def write_stats(stats_file, stats, num_files):
+    stats = sort_by_value(stats)
+
+    with open(stats_file, 'w') as stats_h:
+        for k, v in stats.items():
+            stats_h.write('{:40} {}\n'.format(k, v))
+        stats_h.write('\n')
+        stats_h.write('{:40} {}\n'.format('Parsed-files', num_files))
+
 def sort_by_value(dic):
     return OrderedDict(sorted(dic.items(), key=lambda x: x[1]))
 
@@ -137,53 +455,90 @@ def sort_by_value(dic):
 @click.argument('stats_file', type=click.Path(), envvar='STATS_FILE', default='okh1_stats.txt')
 @click.argument('okh_dir', type=click.Path(), envvar='OHK_DIR', default='okh1_files')
 @click.option('--redownload', '-r')
+@click.option('--connect-timeout', type=float, default=DEFAULT_TIMEOUTS[0],
+        show_default=True, help='Seconds to wait for a host to accept the connection')
+@click.option('--read-timeout', type=float, default=DEFAULT_TIMEOUTS[1],
+        show_default=True, help='Seconds to wait for data from a host')
+@click.option('--host-timeout', multiple=True, metavar='HOST=CONNECT,READ',
+        help='Overrides the timeouts for a single host; may be given multiple times')
+@click.option('--retries', type=int, default=DEFAULT_RETRIES, show_default=True,
+        help='How often to retry a failed download')
+@click.option('--hedge-percentile', type=click.FloatRange(0, 100), default=None,
+        help='Send a second request when a download takes longer than this latency percentile of its host')
+@click.option('--profile', 'profile_file', type=click.Path(dir_okay=False), default=None,
+        help='Write a per-phase time report to this file (JSON if it ends in .json)')
+@click.option('--profile-memory', is_flag=True,
+        help='With --profile, also record the memory peak per phase (slows down parsing several times)')
+@click.option('--cprofile-dir', type=click.Path(file_okay=False), default=None,
+        help='With --profile, also write a cProfile dump per phase into this directory')
+@click.option('--quiet', '-q', is_flag=True,
+        help='Do not print a line per downloaded and parsed file')
 @click.version_option("1.0")
 def gather_stats(stats_file='okh1_stats.txt', okh_dir='okh1_files',
-        redownload=False):
+        redownload=False, connect_timeout=DEFAULT_TIMEOUTS[0],
+        read_timeout=DEFAULT_TIMEOUTS[1], host_timeout=(),
+        retries=DEFAULT_RETRIES, hedge_percentile=None,
+        profile_file=None, profile_memory=False, cprofile_dir=None, quiet=False):
     '''
+    Gathers statistics about the keys used in OKH YAML files.
+
+    \b
     1. Downloads the Open Know-How (OKH) meta-data files
        from the main list,
     2. parses them, and
     3. gathers statistics about the used properties within.
     '''
 
+    profiler = Profiler(cprofile_dir=cprofile_dir, trace_memory=profile_memory) \
+            if profile_file else NO_PROFILER
+    try:
+        gather_stats_profiled(stats_file, okh_dir, redownload, profiler,
+                verbose=not quiet,
+                timeouts=(connect_timeout, read_timeout),
+                host_timeouts=parse_host_timeouts(host_timeout),
+                retries=retries, hedge_percentile=hedge_percentile)
+    finally:
+        if profile_file:
+            profiler.write_report(profile_file)
+
+def gather_stats_profiled(stats_file, okh_dir, redownload, profiler,
+        verbose=True, **downloader_args):
+    '''
+    Does the work of gather_stats(),
+    recording the download, clean, parse, aggregate and write phases.
+    '''
     if not os.path.exists(okh_dir) or redownload:
-        dl_stats = download_all_ymls(okh_dir)
+        downloader = Downloader(verbose=verbose, **downloader_args)
+        try:
+            with profiler.phase('download'):
+                dl_stats = download_all_ymls(okh_dir, downloader)
+        finally:
+            downloader.close()
         print(dl_stats)
 
     stats = {}
     file_i = 0
-    for yaml_file in glob.glob(os.path.join(okh_dir, '*-okh.yml')):
-        print('')
+    for yaml_file in list_yaml_files(okh_dir):
         #if yaml_file.endswith('/Incubator-okh.yml') or
         #        yaml_file.endswith('/Hand-Pump-Drill-SpringLoaded-okh.yml'):
         #    eprint('WARNING: Skipping invalid file "%s" ...' % yaml_file)
         #    continue
-        print('Cleaning up "%s" ...' % yaml_file)
-        yaml_file_clean = yaml_file + ".clean"
-        with open(yaml_file, 'rt') as fin:
-            with open(yaml_file_clean, 'wt') as fout:
-                for line in fin:
-                    fout.write(line.replace(': @', ': '))
-        #os.rename(yaml_file_clean, yaml_file)
-
-        print('Parsing "%s" ...' % yaml_file)
-        with open(yaml_file, 'r') as yaml_h:
-            # skip first line
-            next(yaml_h)
-            yaml_cont = yaml.load(yaml_h, Loader=yaml.SafeLoader)
-            #yaml_cont = yaml.load(yaml_h, Loader=yaml.CLoader)
-            #yaml_cont = yaml.load(yaml_h)
-            append_stats(stats, yaml_cont)
-            file_i = file_i + 1
+        if verbose:
+            print('')
+            print('Cleaning up "%s" ...' % yaml_file)
+        with profiler.phase('clean'):
+            clean_yaml_file(yaml_file)
 
-    stats = sort_by_value(stats)
+        if verbose:
+            print('Parsing "%s" ...' % yaml_file)
+        with profiler.phase('parse'):
+            yaml_cont = parse_yaml_file(yaml_file)
+        with profiler.phase('aggregate'):
+            append_stats(stats, yaml_cont)
+        file_i = file_i + 1
 
-    with open(stats_file, 'w') as stats_h:
-        for k, v in stats.items():
-            stats_h.write('{:40} {}\n'.format(k, v))
-        stats_h.write('\n')
-        stats_h.write('{:40} {}\n'.format('Parsed-files', file_i))
+    with profiler.phase('write'):
+        write_stats(stats_file, stats, file_i)
 
 if __name__ == '__main__':
     gather_stats()
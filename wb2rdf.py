@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+'''
+Exports all items and properties of a WikiBase instance to RDF.
+It is the reverse direction of rdfont2wb.py,
+and allows to check the WikiBase ontology for drift,
+or to rebuild the RDF-to-WikiBase link file.
+
+Entities are fetched in parallel batches through the API (api.php),
+and their triples are streamed to disk as the batches arrive,
+without ever building a full in-memory graph.
+'''
+
+import os
+import sys
+import json
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import rdflib
+from rdflib.namespace import SKOS, OWL, RDF, RDFS
+from rdflib.plugins.serializers.nt import _nt_row
+import click
+from wikibase import WBSession, API_URL_OHO
+from rdfont2wb import RDF_TO_WB_LINK_FILE, SCHEMA, get_label_preds
+
+CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
+
+# Maximum number of IDs wbgetentities accepts per request (for non-bots)
+BATCH_SIZE = 50
+NUM_WORKERS = 8
+# Default WikiBase namespaces of the Item and Property pages
+NS_ITEM = 120
+NS_PROPERTY = 122
+
+FORMATS = ['turtle', 'nt']
+
+def entity_base(api_url):
+    '''
+    Returns the base of the concept URIs of the entities of a WikiBase instance,
+    eg. "https://wikibase.oho.wiki/entity/" for
+    "https://wikibase.oho.wiki/api.php".
+    '''
+    return api_url.rsplit('/', 1)[0] + '/entity/'
+
+def chunks(values, size):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+class TripleWriter:
+    '''
+    Writes triples one by one to a file handle,
+    as either Turtle or N-Triples.
+    '''
+    def __init__(self, out_h, fmt='turtle', prefixes=None):
+        self.out_h = out_h
+        self.fmt = fmt
+        self.num_triples = 0
+        self.nsm = None
+        if fmt == 'turtle':
+            self.nsm = rdflib.Graph().namespace_manager
+            for prefix, namespace in (prefixes or {}).items():
+                self.nsm.bind(prefix, namespace, override=True)
+            for prefix, namespace in self.nsm.namespaces():
+                self.out_h.write('@prefix %s: <%s> .\n' % (prefix, namespace))
+            self.out_h.write('\n')
+
+    def write(self, subj, pred, obj):
+        if self.fmt == 'nt':
+            self.out_h.write(_nt_row((subj, pred, obj)))
+        else:
+            self.out_h.write('%s %s %s .\n' % (subj.n3(self.nsm),
+                    pred.n3(self.nsm), obj.n3(self.nsm)))
+        self.num_triples = self.num_triples + 1
+
+class WikiBase2RdfExporter:
+
+    def __init__(self, wbs, link_graph_file=None, ontology=None,
+            batch_size=BATCH_SIZE, workers=NUM_WORKERS):
+        self.wbs = wbs
+        self.entity_base = rdflib.Namespace(entity_base(wbs.api_url))
+        self.batch_size = batch_size
+        self.workers = workers
+        self.default_language = 'en'
+        # WikiBase ID -> RDF reference
+        self.wb2rdf = {}
+        if link_graph_file is not None and os.path.exists(link_graph_file):
+            links = rdflib.Graph()
+            links.load(link_graph_file, format='turtle')
+            for rdf_ref, _, wb_id in links.triples((None, SCHEMA.identifier, None)):
+                self.wb2rdf[str(wb_id)] = rdf_ref
+        self.ontology = ontology
+
+    def rdf_ref(self, wb_id):
+        '''
+        Returns the RDF reference that the given WikiBase entity represents,
+        or its WikiBase concept URI, if we do not know any.
+        '''
+        rdf_ref = self.wb2rdf.get(wb_id)
+        return rdf_ref if rdf_ref is not None else self.entity_base[wb_id]
+
+    def fetch_entities(self, wb_ids, props=None):
+        '''
+        Fetches the given entities in parallel batches,
+        and yields them in the order the batches arrive.
+        Only a bounded number of batches is in flight at any time.
+        '''
+        kwargs = {} if props is None else {'props': props}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = set()
+            for batch in chunks(wb_ids, self.batch_size):
+                pending.add(executor.submit(self.wbs.get_entities, batch, **kwargs))
+                if len(pending) >= 2 * self.workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for fut in done:
+                        yield from fut.result().values()
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    yield from fut.result().values()
+
+    def match_ontology_labels(self, wb_ids):
+        '''
+        Maps the given entities that are not yet in the link mapping
+        to subjects of the ontology, by their (unique) default language label.
+        '''
+        subj_by_label = {}
+        for lb_prop in get_label_preds():
+            for subj, _, lb in self.ontology.triples((None, lb_prop, None)):
+                if lb.language in (None, self.default_language):
+                    subj_by_label.setdefault(str(lb), set()).add(subj)
+        unmapped = [wb_id for wb_id in wb_ids if wb_id not in self.wb2rdf]
+        num_matched = 0
+        for ent in self.fetch_entities(unmapped, props='labels'):
+            label = ent.get('labels', {}).get(self.default_language)
+            subjs = subj_by_label.get(label['value'], ()) if label else ()
+            if len(subjs) == 1:
+                self.wb2rdf[ent['id']] = next(iter(subjs))
+                num_matched = num_matched + 1
+        print('- Matched %d of %d unmapped entities by label'
+                % (num_matched, len(unmapped)), file=sys.stderr)
+
+    def value_term(self, snak):
+        '''
+        Converts the value of a WikiBase snak into an RDF term,
+        or returns None for "no value" and "some value" snaks.
+        '''
+        if snak['snaktype'] != 'value':
+            return None
+        datavalue = snak['datavalue']
+        value = datavalue['value']
+        value_type = datavalue['type']
+        if value_type == 'wikibase-entityid':
+            return self.rdf_ref(value['id'])
+        if value_type == 'string':
+            if snak.get('datatype') == 'url':
+                return rdflib.URIRef(value)
+            return rdflib.Literal(value)
+        if value_type == 'monolingualtext':
+            return rdflib.Literal(value['text'], lang=value['language'])
+        if value_type == 'time':
+            return rdflib.Literal(value['time'])
+        if value_type == 'quantity':
+            return rdflib.Literal(value['amount'])
+        return rdflib.Literal(json.dumps(value, sort_keys=True))
+
+    def entity_triples(self, ent):
+        '''
+        Yields the triples representing a single WikiBase entity.
+        '''
+        subj = self.rdf_ref(ent['id'])
+        if ent['type'] == 'item':
+            yield (subj, RDF.type, OWL.Class)
+        elif ent.get('datatype') in ('wikibase-item', 'wikibase-property'):
+            yield (subj, RDF.type, OWL.ObjectProperty)
+        else:
+            yield (subj, RDF.type, OWL.DatatypeProperty)
+        yield (subj, SCHEMA.identifier, rdflib.Literal(ent['id']))
+        for lng, lb in ent.get('labels', {}).items():
+            yield (subj, RDFS.label, rdflib.Literal(lb['value'], lang=lng))
+        for lng, dsc in ent.get('descriptions', {}).items():
+            yield (subj, RDFS.comment, rdflib.Literal(dsc['value'], lang=lng))
+        for lng, aliases in ent.get('aliases', {}).items():
+            for alias in aliases:
+                yield (subj, SKOS.altLabel, rdflib.Literal(alias['value'], lang=lng))
+        for prop_id, statements in ent.get('claims', {}).items():
+            pred = self.rdf_ref(prop_id)
+            for statement in statements:
+                obj = self.value_term(statement['mainsnak'])
+                if obj is not None:
+                    yield (subj, pred, obj)
+
+    def export(self, out_h, fmt='turtle', wb_ids=None, links_h=None):
+        '''
+        Exports the given entities - or all of them, if None -
+        to an open file handle.
+        If links_h is given, the RDF-to-WikiBase links of all entities
+        that map to an RDF reference are written to it as Turtle,
+        in the format of the link file written by rdfont2wb.py.
+        '''
+        if wb_ids is None:
+            wb_ids = list(self.wbs.list_entity_ids(NS_ITEM)) \
+                    + list(self.wbs.list_entity_ids(NS_PROPERTY))
+        print('- Exporting %d entities ...' % len(wb_ids), file=sys.stderr)
+        if self.ontology is not None:
+            self.match_ontology_labels(wb_ids)
+
+        prefixes = {'owl': OWL, 'skos': SKOS, 'schema': SCHEMA, 'wb': self.entity_base}
+        writer = TripleWriter(out_h, fmt, prefixes)
+        links = TripleWriter(links_h, 'turtle', prefixes) if links_h is not None else None
+        num_entities = 0
+        for ent in self.fetch_entities(wb_ids):
+            for triple in self.entity_triples(ent):
+                writer.write(*triple)
+            if links is not None and ent['id'] in self.wb2rdf:
+                links.write(self.wb2rdf[ent['id']], SCHEMA.identifier,
+                        rdflib.Literal(ent['id']))
+            num_entities = num_entities + 1
+            if num_entities % 1000 == 0:
+                print('- ... %d entities exported' % num_entities, file=sys.stderr)
+        print('- Exported %d entities as %d triples'
+                % (num_entities, writer.num_triples), file=sys.stderr)
+
+@click.command(context_settings=CONTEXT_SETTINGS)
+@click.argument('out_file', type=click.Path(dir_okay=False, allow_dash=True),
+        default='wb_export.ttl')
+@click.option('--format', '-f', 'fmt', type=click.Choice(FORMATS),
+        default='turtle', show_default=True)
+@click.option('--api-url', default=API_URL_OHO, show_default=True)
+@click.option('--link-file', type=click.Path(dir_okay=False),
+        default=RDF_TO_WB_LINK_FILE, show_default=True,
+        help='Maps WikiBase IDs back to RDF references, if it exists')
+@click.option('--ontology', type=click.Path(dir_okay=False), default=None,
+        help='Turtle ontology to match unmapped entities against, by label')
+@click.option('--links-out', type=click.Path(dir_okay=False), default=None,
+        help='Write the (rebuilt) RDF-to-WikiBase links to this file')
+@click.option('--workers', type=int, default=NUM_WORKERS, show_default=True,
+        help='Number of batches to fetch in parallel')
+@click.version_option("0.1.0")
+def cli(out_file, fmt='turtle', api_url=API_URL_OHO,
+        link_file=RDF_TO_WB_LINK_FILE, ontology=None, links_out=None,
+        workers=NUM_WORKERS):
+    '''
+    Exports all items and properties of a WikiBase instance to RDF.
+    '''
+    wbs = WBSession(api_url)
+    ont_graph = None
+    if ontology is not None:
+        ont_graph = rdflib.Graph()
+        ont_graph.load(ontology, format='turtle')
+    exporter = WikiBase2RdfExporter(wbs, link_file, ont_graph, workers=workers)
+    links_h = open(links_out, 'w') if links_out is not None else None
+    try:
+        with click.open_file(out_file, 'w') as out_h:
+            exporter.export(out_h, fmt, links_h=links_h)
+    finally:
+        if links_h is not None:
+            links_h.close()
+        wbs.close()
+
+if __name__ == "__main__":
+    cli()
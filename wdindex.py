@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+'''
+Builds a compact, on-disk lookup table of all the Wikidata properties,
+from a local Wikidata JSON dump (eg. latest-all.json.bz2 or .gz, see:
+https://www.wikidata.org/wiki/Wikidata:Database_download#JSON_dumps_(recommended) ),
+and allows to look up Wikidata properties by the URIs of their
+equivalents in other ontologies (eg. "http://schema.org/version" -> P348).
+
+The dump is streamed line by line (one entity per line),
+so memory use is bounded, no matter the size of the dump.
+Only the property lines get parsed, in a pool of worker processes.
+The resulting table is an SQLite file.
+'''
+
+import os
+import bz2
+import gzip
+import json
+import sqlite3
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import click
+
+CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
+
+WD_INDEX_FILE = 'wd_properties.sqlite'
+# Wikidata properties whose (URL) values state equivalent external URIs
+# P1628: equivalent property, P2888: exact match
+EQUIV_PROPS = ['P1628', 'P2888']
+CHUNK_SIZE = 256
+NUM_WORKERS = os.cpu_count() or 1
+
+def open_dump(dump_file):
+    if dump_file.endswith('.bz2'):
+        return bz2.open(dump_file, 'rt', encoding='utf-8')
+    if dump_file.endswith('.gz'):
+        return gzip.open(dump_file, 'rt', encoding='utf-8')
+    return open(dump_file, 'r', encoding='utf-8')
+
+def normalize_uri(uri):
+    '''
+    Normalizes a URI for lookup,
+    as Wikidata lists eg. both "http://schema.org/x" and "https://schema.org/x/".
+    '''
+    uri = str(uri).strip()
+    if uri.startswith('https://'):
+        uri = 'http://' + uri[len('https://'):]
+    return uri.rstrip('/')
+
+def is_property_line(line):
+    '''
+    Cheaply checks whether a line of the dump holds a property,
+    without parsing it; entities start with their type.
+    '''
+    return '"type":"property"' in line[:64]
+
+def extract_properties(lines):
+    '''
+    Parses the given dump lines,
+    and returns a list of (id, label, datatype, [equivalent URIs]) tuples.
+    Runs in a worker process.
+    '''
+    props = []
+    for line in lines:
+        ent = json.loads(line.rstrip().rstrip(','))
+        label = ent.get('labels', {}).get('en', {}).get('value')
+        equivs = []
+        for equiv_prop in EQUIV_PROPS:
+            for statement in ent.get('claims', {}).get(equiv_prop, []):
+                snak = statement['mainsnak']
+                if snak['snaktype'] == 'value':
+                    equivs.append(snak['datavalue']['value'])
+        props.append((ent['id'], label, ent.get('datatype'), equivs))
+    return props
+
+def property_line_chunks(dump_h, chunk_size):
+    chunk = []
+    for line in dump_h:
+        if is_property_line(line):
+            chunk.append(line)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+def build_index(dump_file, index_file, workers=NUM_WORKERS, chunk_size=CHUNK_SIZE):
+    '''
+    Streams the dump, and writes the property lookup table.
+    Returns the number of properties indexed.
+    '''
+    tmp_file = index_file + '.tmp'
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+    db = sqlite3.connect(tmp_file)
+    db.execute('CREATE TABLE properties (id TEXT PRIMARY KEY, label TEXT, datatype TEXT)')
+    db.execute('CREATE TABLE equivalents (uri TEXT, id TEXT)')
+
+    def store(props):
+        db.executemany('INSERT OR REPLACE INTO properties VALUES (?, ?, ?)',
+                [(wd_id, label, datatype) for wd_id, label, datatype, _ in props])
+        db.executemany('INSERT INTO equivalents VALUES (?, ?)',
+                [(normalize_uri(uri), wd_id) for wd_id, _, _, equivs in props
+                    for uri in equivs])
+        return len(props)
+
+    num_props = 0
+    with open_dump(dump_file) as dump_h, \
+            ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for chunk in property_line_chunks(dump_h, chunk_size):
+            pending.add(executor.submit(extract_properties, chunk))
+            # Bound the number of chunks in memory
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    num_props = num_props + store(fut.result())
+        for fut in pending:
+            num_props = num_props + store(fut.result())
+
+    db.execute('CREATE INDEX equivalents_uri ON equivalents (uri)')
+    db.commit()
+    db.execute('VACUUM')
+    db.close()
+    os.replace(tmp_file, index_file)
+    return num_props
+
+class WikidataPropertyIndex:
+    '''
+    Looks up Wikidata properties in a table written by build_index().
+    '''
+    def __init__(self, index_file=WD_INDEX_FILE):
+        self.db = sqlite3.connect('file:%s?mode=ro' % index_file, uri=True)
+        self.lookup = lru_cache(maxsize=None)(self.lookup)
+
+    def close(self):
+        self.db.close()
+
+    def lookup(self, uri):
+        '''
+        Returns the (id, label, datatype) tuples of all the Wikidata properties
+        declared equivalent to the given URI, ordered by their numeric ID.
+        '''
+        rows = self.db.execute(
+                'SELECT p.id, p.label, p.datatype FROM equivalents e'
+                ' JOIN properties p ON p.id = e.id WHERE e.uri = ?',
+                (normalize_uri(uri),)).fetchall()
+        return sorted(set(rows), key=lambda row: int(row[0][1:]))
+
+    def resolve(self, uri):
+        '''
+        Returns the (id, label, datatype) of the oldest Wikidata property
+        equivalent to the given URI, or None.
+        '''
+        matches = self.lookup(uri)
+        return matches[0] if matches else None
+
+    def get(self, wd_id):
+        '''
+        Returns the (id, label, datatype) of a Wikidata property, or None.
+        '''
+        return self.db.execute('SELECT id, label, datatype FROM properties WHERE id = ?',
+                (wd_id,)).fetchone()
+
+@click.group(context_settings=CONTEXT_SETTINGS)
+@click.version_option("0.1.0")
+def cli():
+    '''
+    Indexes the properties of a Wikidata JSON dump by equivalent URI.
+    '''
+
+@cli.command()
+@click.argument('dump_file', type=click.Path(exists=True, dir_okay=False))
+@click.argument('index_file', type=click.Path(dir_okay=False), default=WD_INDEX_FILE)
+@click.option('--workers', type=int, default=NUM_WORKERS, show_default=True,
+        help='Number of processes parsing the property entities')
+def build(dump_file, index_file=WD_INDEX_FILE, workers=NUM_WORKERS):
+    '''
+    Streams a Wikidata JSON dump (.json, .json.bz2 or .json.gz)
+    into a property lookup table.
+    '''
+    num_props = build_index(dump_file, index_file, workers)
+    print('Indexed %d properties into "%s"' % (num_props, index_file))
+
+@cli.command()
+@click.argument('uris', nargs=-1, required=True)
+@click.option('--index', 'index_file', type=click.Path(exists=True, dir_okay=False),
+        default=WD_INDEX_FILE, show_default=True)
+def lookup(uris, index_file=WD_INDEX_FILE):
+    '''
+    Looks up the Wikidata properties equivalent to the given URIs.
+    '''
+    wd_index = WikidataPropertyIndex(index_file)
+    for uri in uris:
+        matches = wd_index.lookup(uri)
+        if not matches:
+            print('%s\t-' % uri)
+        for wd_id, label, datatype in matches:
+            print('%s\t%s\t%s\t%s' % (uri, wd_id, datatype, label))
+    wd_index.close()
+
+if __name__ == "__main__":
+    cli()
@@ -17,7 +17,9 @@ see:
 
 import json
 import re
+import time
 import logging
+import threading
 import requests
 
 try: # for Python 3
@@ -45,14 +47,27 @@ def enable_debug():
     requests_log.setLevel(logging.DEBUG)
     requests_log.propagate = True
 
+class WBApiError(RuntimeError):
+    '''
+    An error reported by the API (api.php),
+    carrying the MediaWiki error code (eg. "ratelimited" or "badtoken").
+    '''
+    def __init__(self, code, info, action='calling the API'):
+        super().__init__('Failed %s, reason: %s - %s' % (action, code, info))
+        self.code = code
+        self.info = info
+
 class WBSession:
     '''
     Represents a session of HTTP communication with a Wiki-Base instance,
     through its "api.php".
     '''
-    def __init__(self, api_url):
+    def __init__(self, api_url, verbose=True):
         self.http_sess = requests.Session()
         self.api_url = api_url
+        self.verbose = verbose
+        self.csrf_token = None
+        self.logged_in = False
 
     def call_api(self, params=None, data=None, method='POST'):
         '''
@@ -61,6 +76,13 @@ class WBSession:
         req = self.http_sess.request(method=method, url=self.api_url, params=params, data=data)
         return req
 
+    def log(self, *args):
+        '''
+        Prints progress info about single API calls, if verbose.
+        '''
+        if self.verbose:
+            print(*args)
+
     def close(self):
         '''
         Closes this session.
@@ -99,6 +121,11 @@ class WBSession:
         req = self.call_api(data=params_login)
         ans = req.json()
         #print(ans)
+        if ans.get('login', {}).get('result') != 'Success':
+            raise RuntimeError('Failed to log into WikiBase at "%s" as "%s", reason: %s' %
+                    (self.api_url, bot_user, ans.get('login', ans.get('error'))))
+        self.csrf_token = None
+        self.logged_in = True
 
     def fetch_login_token(self) -> str:
         """ Fetch login token via `tokens` module """
@@ -138,6 +165,8 @@ class WBSession:
 
         if login_success:
             print('Login success! Welcome, ' + data['clientlogin']['username'] + '!')
+            self.csrf_token = None
+            self.logged_in = True
         else:
             raise RuntimeError('Failed to log into WikiBase at "%s", error: %d' %
                     (self.api_url, data['clientlogin']['messagecode']))
@@ -146,34 +175,59 @@ class WBSession:
         '''
         Requests a standard token, required to do almost any interaction
         with the API.
+        The token is cached until it gets rejected, or we log in again.
         '''
+        if self.csrf_token is not None:
+            return self.csrf_token
         res = self.call_api(params={'action':'query', 'meta':'tokens', 'format':'json'})
         if res.status_code != 200:
-            raise RuntimeError('Failed to get token; HTTP error: {}' % res.status_code)
+            raise RuntimeError('Failed to get token; HTTP error: %s' % res.status_code)
 
         res_data = json.loads(res.content)
-        return res_data['query']['tokens']['csrftoken']
+        self.csrf_token = res_data['query']['tokens']['csrftoken']
+        return self.csrf_token
+
+    def call_write_api(self, params):
+        '''
+        Calls a writing action of the API, and returns the parsed answer.
+        If our token got rejected, it fetches a new one and tries once more.
+        When logged in, the API is asked to fail instead of silently
+        editing anonymously, should our login have expired.
+        '''
+        if self.logged_in:
+            params = dict(params, **{'assert': 'user'})
+        for _ in range(2):
+            res = self.call_api(
+                    method='POST',
+                    params=params,
+                    data={'token': self.request_token()}
+                )
+            if res.status_code == 429:
+                raise WBApiError('ratelimited', 'HTTP 429 Too Many Requests',
+                        'calling "%s"' % params['action'])
+            ans = res.json()
+            if ans.get('error', {}).get('code') != 'badtoken':
+                break
+            self.csrf_token = None
+        return ans
 
     def clear_thing(self, part_id):
         '''
         Clears everything from an Item or Property.
         '''
-        print('- Clear Item/Property ...')
-        res = self.call_api(
-                method='POST',
+        self.log('- Clear Item/Property ...')
+        ans = self.call_write_api(
                 params = {
                     'action': 'wbeditentity',
                     'id': part_id,
                     'clear': 'true',
                     'format':'json',
                     'data': '{}'
-                },
-                data = {'token': self.request_token()}
+                }
             )
-        ans = res.json()
         if 'error' in ans:
-            raise RuntimeError('Failed creating item, reason: %s - %s'
-                    % (ans['error']['code'], ans['error']['info']))
+            raise WBApiError(ans['error']['code'], ans['error']['info'],
+                    'creating item')
 
     def add_wb_thing_claims(self, wb_id, claims={}):
         '''
@@ -186,8 +240,8 @@ class WBSession:
         '''
         Creates a new WikiBase item.
         '''
-        print('- Create Item/Property ...')
-        print(json.dumps(data))
+        self.log('- Create Item/Property ...')
+        self.log(json.dumps(data))
         params = {
             'action': 'wbeditentity',
             #'site': site,
@@ -201,12 +255,7 @@ class WBSession:
         else:
             params['id'] = wb_id
 
-        res = self.call_api(
-                method = 'POST',
-                params = params,
-                data = {'token': self.request_token()}
-            )
-        ans = res.json()
+        ans = self.call_write_api(params)
 
         if 'error' in ans:
             #print(ans)
@@ -221,23 +270,75 @@ class WBSession:
                 wb_id = match.group(1)
                 self.clear_thing(wb_id)
                 return self.create_wb_thing_raw(item, data, wb_id)
-            raise RuntimeError('Failed creating item, reason: %s - %s'
-                    % (ans['error']['code'], ans['error']['info']))
+            raise WBApiError(ans['error']['code'], ans['error']['info'],
+                    'creating item')
 
-        print(ans)
+        self.log(ans)
         return ans['entity']['id']
 
-    def create_wb_thing(self, item=True, labels={}, descriptions={}, claims={}, property_type='string') -> str:
+    def list_entity_ids(self, namespace):
+        '''
+        Lists the IDs of all the entities (eg. "Q123" or "P12")
+        on pages in the given namespace.
+        On a default WikiBase setup, items live in namespace 120,
+        and properties in namespace 122.
+        '''
+        id_pat = re.compile('([QP][0-9]+)$')
+        params = {
+            'action': 'query',
+            'list': 'allpages',
+            'apnamespace': namespace,
+            'aplimit': 'max',
+            'format': 'json'
+            }
+        while True:
+            res = self.call_api(method='GET', params=params)
+            ans = res.json()
+            if 'error' in ans:
+                raise WBApiError(ans['error']['code'], ans['error']['info'],
+                        'listing pages')
+            for page in ans['query']['allpages']:
+                match = id_pat.search(page['title'])
+                if match:
+                    yield match.group(1)
+            if 'continue' not in ans:
+                break
+            params.update(ans['continue'])
+
+    def get_entities(self, wb_ids, props='labels|descriptions|aliases|claims|datatype') -> dict:
+        '''
+        Fetches the given entities (at most 50) in a single request,
+        and returns them as a dict: ID -> entity JSON.
+        Entities that do not exist are left out.
+        '''
+        res = self.call_api(
+                method='GET',
+                params={
+                    'action': 'wbgetentities',
+                    'ids': '|'.join(wb_ids),
+                    'props': props,
+                    'format': 'json'
+                })
+        ans = res.json()
+        if 'error' in ans:
+            raise WBApiError(ans['error']['code'], ans['error']['info'],
+                    'fetching entities')
+        return {wb_id: ent for wb_id, ent in ans['entities'].items()
+                if 'missing' not in ent}
+
+    def create_wb_thing(self, item=True, labels={}, descriptions={}, claims={}, property_type='string', wb_id=None) -> str:
         '''
         Creates a WikiBase item or property,
         and returns its id (eg. "Q123456" or "P12345") if successful.
         @param property_type see the list at: https://wikibase.oho.wiki/index.php?title=Special:NewProperty
+        @param wb_id if given, sets the labels and descriptions
+            of this existing entity instead (its datatype can not be changed)
         '''
         data = {
                 'labels': {},
                 'descriptions': {},
                 }
-        if not item:
+        if not item and wb_id is None:
             data['datatype'] = property_type # see the following list (extracted from: https://wikibase.oho.wiki/index.php?title=Special:NewProperty )
         for label_lang in labels.keys():
             if isinstance(labels[label_lang], list):
@@ -265,7 +366,155 @@ class WBSession:
                             'language': desc_lang,
                             'value': desc
                         }
-        return self.create_wb_thing_raw(item, data)
+        return self.create_wb_thing_raw(item, data, wb_id)
+
+# MediaWiki error codes telling us that an account is being throttled
+THROTTLE_ERRORS = ['ratelimited', 'actionthrottledtext', 'maxlag']
+# MediaWiki error codes telling us that an account lost its login
+LOGGED_OUT_ERRORS = ['assertuserfailed', 'assertbotfailed', 'notloggedin']
+
+class WBAccount:
+    '''
+    One bot account of a WBSessionPool,
+    with its own HTTP session (and thus token cache) and rate budget.
+    '''
+    def __init__(self, api_url, bot_user, bot_passwd, min_interval=0.0, verbose=True):
+        self.wbs = WBSession(api_url, verbose)
+        self.bot_user = bot_user
+        self.bot_passwd = bot_passwd
+        self.min_interval = min_interval
+        # Do not use this account before this time (see time.monotonic())
+        self.next_free = 0.0
+        self.num_throttled = 0
+        self.num_writes = 0
+        self.alive = True
+
+    def login(self):
+        self.wbs.bot_login(self.bot_user, self.bot_passwd)
+
+    def throttle(self, base_delay):
+        '''
+        Takes this account out of rotation for a while,
+        doubling the delay each time it gets throttled in a row.
+        '''
+        delay = base_delay * (2 ** min(self.num_throttled, 6))
+        self.num_throttled = self.num_throttled + 1
+        self.next_free = time.monotonic() + delay
+        print('- Account "%s" is throttled, pausing it for %.0fs ...'
+                % (self.bot_user, delay))
+
+class WBSessionPool:
+    '''
+    Spreads the write load over multiple bot accounts,
+    to get beyond the per-user edit rate limit of MediaWiki.
+    Each write goes to the account that may write the soonest,
+    given its rate budget;
+    if that account gets throttled or logged out,
+    the write is retried on another one.
+
+    It offers the same writing methods as WBSession,
+    so it can be used in place of it, eg. by RdfOntology2WikiBaseConverter.
+    '''
+    def __init__(self, api_url, credentials, edits_per_minute=None,
+            throttle_delay=60.0, max_attempts=None, verbose=True):
+        '''
+        @param credentials list of (bot_user, bot_passwd) tuples,
+            see: https://www.mediawiki.org/wiki/Special:BotPasswords
+        @param edits_per_minute the rate budget of each single account,
+            or None for no client-side limit
+        '''
+        if len(credentials) == 0:
+            raise RuntimeError('A session pool needs at least one account')
+        self.api_url = api_url
+        min_interval = 60.0 / edits_per_minute if edits_per_minute else 0.0
+        self.accounts = [WBAccount(api_url, user, passwd, min_interval, verbose)
+                for user, passwd in credentials]
+        self.throttle_delay = throttle_delay
+        self.max_attempts = max_attempts if max_attempts is not None \
+                else 3 * len(self.accounts)
+        self.lock = threading.Lock()
+
+    def login(self):
+        '''
+        Logs in all the accounts.
+        '''
+        for account in self.accounts:
+            account.login()
+        print('Logged in %d accounts' % len(self.accounts))
+
+    def close(self):
+        for account in self.accounts:
+            account.wbs.close()
+
+    def acquire(self) -> WBAccount:
+        '''
+        Returns the account that may write the soonest,
+        after waiting until its rate budget allows it to.
+        '''
+        with self.lock:
+            alive = [acc for acc in self.accounts if acc.alive]
+            if len(alive) == 0:
+                raise RuntimeError('All accounts of the session pool are unusable')
+            account = min(alive, key=lambda acc: acc.next_free)
+            now = time.monotonic()
+            start = max(now, account.next_free)
+            account.next_free = start + account.min_interval
+        if start > now:
+            time.sleep(start - now)
+        return account
+
+    def write(self, method_name, *args, **kwargs):
+        '''
+        Calls a writing method of WBSession on one of the accounts,
+        failing over to another account on throttling or a lost login.
+        '''
+        attempts = 0
+        while True:
+            account = self.acquire()
+            try:
+                res = getattr(account.wbs, method_name)(*args, **kwargs)
+                account.num_throttled = 0
+                account.num_writes = account.num_writes + 1
+                return res
+            except WBApiError as err:
+                attempts = attempts + 1
+                if err.code in THROTTLE_ERRORS:
+                    account.throttle(self.throttle_delay)
+                elif err.code in LOGGED_OUT_ERRORS:
+                    print('- Account "%s" got logged out, logging in again ...'
+                            % account.bot_user)
+                    try:
+                        account.login()
+                    except RuntimeError as login_err:
+                        print('- Dropping account "%s": %s'
+                                % (account.bot_user, login_err))
+                        account.alive = False
+                else:
+                    raise
+                if attempts >= self.max_attempts:
+                    raise
+
+    def call_api(self, params=None, data=None, method='POST'):
+        '''
+        Calls the API through the first usable account,
+        without touching any rate budget;
+        only meant for reading.
+        '''
+        account = next((acc for acc in self.accounts if acc.alive), self.accounts[0])
+        return account.wbs.call_api(params, data, method)
+
+    def clear_thing(self, part_id):
+        return self.write('clear_thing', part_id)
+
+    def add_wb_thing_claims(self, wb_id, claims={}):
+        return self.write('add_wb_thing_claims', wb_id, claims)
+
+    def create_wb_thing_raw(self, item=True, data={}, wb_id=None) -> str:
+        return self.write('create_wb_thing_raw', item, data, wb_id)
+
+    def create_wb_thing(self, item=True, labels={}, descriptions={}, claims={}, property_type='string', wb_id=None) -> str:
+        return self.write('create_wb_thing', item, labels, descriptions,
+                claims, property_type, wb_id)
 
 if __name__ == "__main__":
     # Run as a CLI script